@@ -1,14 +1,22 @@
 import os
+from posixpath import join
 import requests
 
 class DataImporter:
     API_URL = 'https://data-portal.s5p-pal.com/api/'
 
-    def __init__(self):
+    # seconds to wait for the server before a request fails
+    TIMEOUT = 30
+
+    # path names of the ranges within a collection
+    RANGES = ['day', '3day', 'month', 'season', 'year']
+
+    def __init__(self, api_url=API_URL):
         super(DataImporter, self).__init__()
+        self.API_URL = api_url
 
     def get_collections(self):
-        result = requests.get(os.path.join(self.API_URL, 's5p-l3')).json()
+        result = requests.get(os.path.join(self.API_URL, 's5p-l3'), timeout=self.TIMEOUT).json()
         links = []
         for link in result['links']:
             if link['rel'] == 'child':
@@ -16,13 +24,22 @@ class DataImporter:
         return links
     
     def get_links(self, href):
-        result = requests.get(href).json()
+        result = requests.get(href, timeout=self.TIMEOUT).json()
         return result['links']
     
     def get_links_with_api_url(self, href):
-        result = requests.get(os.path.join(self.API_URL, href)).json()
+        result = requests.get(os.path.join(self.API_URL, href), timeout=self.TIMEOUT).json()
         return result['links']
     
     def get_json(self, href):
-        result = requests.get(href).json()
-        return result
\ No newline at end of file
+        result = requests.get(href, timeout=self.TIMEOUT).json()
+        return result
+
+    def get_range_href(self, collection_href, range_name):
+        return join(collection_href, range_name)
+
+    def get_specific_range_href(self, collection_href, specific_range):
+        return join(collection_href, specific_range)
+
+    def get_item_href(self, collection_href, specific_range, item):
+        return join(collection_href, specific_range, f'{item}.json')
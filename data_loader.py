@@ -10,6 +10,9 @@ class DataLoader:
     LAT_RANGE = np.pi
     LON_RANGE = 2 * np.pi
 
+    # number of points that are sampled or colored at once
+    CHUNK_SIZE = 10000
+
     def __init__(self, sample_count):
         super(DataLoader, self).__init__()
         self.data_file = None
@@ -153,52 +156,50 @@ class DataLoader:
 
         return colors, points
 
-    def convert_data_to_colors_one_point(self, points, lat_index_factors, lon_index_factors):
-        values = np.array([])
-        min_value = None
-        max_value = None
-        for i in range(len(points)):
-            lat_index = np.round(lat_index_factors[i] * self.lat_length)
-            lon_index = np.round(lon_index_factors[i] * self.lon_length)
-
-            # check if indices are out of range
-            if lat_index >= self.lat_length:
-                lat_index = self.lat_length - 1
-            if lon_index >= self.lon_length:
-                lon_index = self.lon_length - 1
-
-            # get value for point
-            value = self.data[int(lat_index)][int(lon_index)]
-
-            # check if value is new min or max
-            if min_value == None or value < min_value:
-                min_value = value
-
-            if max_value == None or value > max_value:
-                max_value = value
-
-            values = np.append(values, value)
-
-        # normalize values
-        values = (values - min_value) / (max_value - min_value)
-        self.max_value = max_value
-        self.min_value = min_value
-
-        # create colors
-        colors = []
-        for val in values:
-            if math.isnan(val):
-                r = 0
-                g = 0
-                b = 0
-            elif val < 0.5:
-                r = 0
-                g = val * 2
-                b = -2 * (val - 0.5)
-            else:
-                r = 2 * (val - 0.5)
-                g = -2*(val - 2) - 2
-                b = 0
-            
-            colors.append([r, g, b])
+    def convert_data_to_colors_one_point(self, points, lat_index_factors, lon_index_factors, task=None):
+        values = self.sample_values(points, lat_index_factors, lon_index_factors, task)
+        return self.convert_values_to_colors(values, task)
+
+    def sample_values(self, points, lat_index_factors, lon_index_factors, task=None):
+        lat_index_factors = np.asarray(lat_index_factors)
+        lon_index_factors = np.asarray(lon_index_factors)
+        # keep the precision of the data, so min and max are shown the same as in the file
+        values = np.empty(len(points), dtype=np.result_type(self.data.dtype, np.float32))
+
+        # sample in chunks, so a superseded task can be cancelled in between
+        for start in range(0, len(points), self.CHUNK_SIZE):
+            if task is not None:
+                task.check_cancelled()
+            end = start + self.CHUNK_SIZE
+
+            # calculate indices and clip the ones that are out of range
+            lat_indices = np.round(lat_index_factors[start:end] * self.lat_length).astype(int)
+            lon_indices = np.round(lon_index_factors[start:end] * self.lon_length).astype(int)
+            lat_indices = np.minimum(lat_indices, self.lat_length - 1)
+            lon_indices = np.minimum(lon_indices, self.lon_length - 1)
+
+            # get values for points, masked (fill) values become nan and are drawn black
+            values[start:end] = np.ma.filled(np.ma.asarray(self.data[lat_indices, lon_indices], dtype=values.dtype), np.nan)
+
+        self.max_value = np.nanmax(values)
+        self.min_value = np.nanmin(values)
+        return values
+
+    def convert_values_to_colors(self, values, task=None):
+        colors = np.zeros((len(values), 3))
+
+        for start in range(0, len(values), self.CHUNK_SIZE):
+            if task is not None:
+                task.check_cancelled()
+            end = start + self.CHUNK_SIZE
+
+            # normalize values
+            val = (values[start:end] - self.min_value) / (self.max_value - self.min_value)
+
+            # create colors, going from blue through green to red. nan values stay black
+            low = val < 0.5
+            high = val >= 0.5
+            colors[start:end, 0] = np.where(high, 2 * (val - 0.5), 0)
+            colors[start:end, 1] = np.where(low, val * 2, np.where(high, -2 * (val - 2) - 2, 0))
+            colors[start:end, 2] = np.where(low, -2 * (val - 0.5), 0)
         return colors
@@ -0,0 +1,102 @@
+import multiprocessing
+import os
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, wait
+from functools import partial
+from data_loader import DataLoader
+
+def load_file(sample_count, file_path):
+    '''Load a file into a new DataLoader. Runs in a decode process, so the file
+    is closed before the DataLoader is sent back.'''
+    data_loader = DataLoader(sample_count)
+    data_loader.load_file(file_path)
+    data_loader.data_file.close()
+    data_loader.data_file = None
+    return data_loader
+
+def start_decode_process():
+    '''Does nothing, but makes a new decode process import the netCDF library
+    before the first file arrives.'''
+    pass
+
+class DataPipeline:
+    '''The DataPipeline class contains the stage functions that turn a dropdown
+    selection into colors for the data map. The functions are run by the
+    TaskScheduler on its worker threads, so they do not touch the GUI and every
+    dataset gets its own DataLoader. Files are decoded in separate processes,
+    because the netCDF library can not be used from several threads at once.'''
+
+    DOWNLOAD_DIRECTORY = './downloaded_data'
+    BLOCK_SIZE = 1024 * 1024
+    DECODE_PROCESSES = 2
+
+    def __init__(self, data_importer, sample_count, points, lat_index_factors, lon_index_factors, download_directory=DOWNLOAD_DIRECTORY):
+        super(DataPipeline, self).__init__()
+        self.data_importer = data_importer
+        self.sample_count = sample_count
+        self.points = points
+        self.lat_index_factors = lat_index_factors
+        self.lon_index_factors = lon_index_factors
+        self.download_directory = download_directory
+        self.decode_pool = ProcessPoolExecutor(self.DECODE_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+        self.decode_processes_started = [self.decode_pool.submit(start_decode_process) for _ in range(self.DECODE_PROCESSES)]
+
+    def links_stages(self, href):
+        return [('fetch', partial(self.fetch_links, href))]
+
+    def dataset_stages(self, href, dataset):
+        return [
+            ('fetch', partial(self.fetch_json, href)),
+            ('download', partial(self.download, dataset)),
+            ('decode', self.decode),
+            ('sample', self.sample),
+            ('color', self.color),
+        ]
+
+    def fetch_links(self, href, task, _):
+        return self.data_importer.get_links(href)
+
+    def fetch_json(self, href, task, _):
+        return self.data_importer.get_json(href)
+
+    def download(self, dataset, task, json):
+        file_path = os.path.join(self.download_directory, f'{dataset}.nc')
+        if os.path.isfile(file_path):
+            return file_path
+
+        # download to a temporary file, so a cancelled download is not mistaken for a complete one
+        os.makedirs(self.download_directory, exist_ok=True)
+        download_link = json['assets']['product']['href']
+        partial_file_path = f'{file_path}.part'
+        try:
+            with urllib.request.urlopen(download_link, timeout=self.data_importer.TIMEOUT) as response, open(partial_file_path, 'wb') as partial_file:
+                while True:
+                    task.check_cancelled()
+                    block = response.read(self.BLOCK_SIZE)
+                    if not block:
+                        break
+                    partial_file.write(block)
+        except BaseException:
+            if os.path.isfile(partial_file_path):
+                os.remove(partial_file_path)
+            raise
+        os.replace(partial_file_path, file_path)
+        return file_path
+
+    def decode(self, task, file_path):
+        return self.decode_pool.submit(load_file, self.sample_count, file_path).result()
+
+    def sample(self, task, data_loader):
+        values = data_loader.sample_values(self.points, self.lat_index_factors, self.lon_index_factors, task)
+        return data_loader, values
+
+    def color(self, task, result):
+        data_loader, values = result
+        colors = data_loader.convert_values_to_colors(values, task)
+        return data_loader, colors
+
+    def wait_until_ready(self):
+        wait(self.decode_processes_started)
+
+    def shutdown(self):
+        self.decode_pool.shutdown(wait=False, cancel_futures=True)
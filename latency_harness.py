@@ -0,0 +1,319 @@
+import argparse
+import json
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from posixpath import join
+import netCDF4
+import numpy as np
+import open3d as o3d
+from open3d import geometry
+from data_importer import DataImporter
+from data_pipeline import DataPipeline
+from mesh_generator import MeshGenerator
+from task_scheduler import TaskScheduler
+
+class MockDataServer:
+    '''The MockDataServer imitates the parts of the s5p-pal STAC API that the
+    application uses, and serves a synthetic netCDF product for every item. Every
+    request is delayed by the given latency, so slow connections can be
+    simulated without a network.'''
+
+    RANGES = DataImporter.RANGES
+    COLLECTION = 'no2'
+    SPECIFIC_RANGE_COUNT = 3
+    ITEM_COUNT = 3
+
+    def __init__(self, lat_count=180, lon_count=360, latency=0.0):
+        super(MockDataServer, self).__init__()
+        self.latency = latency
+        self.directory = tempfile.mkdtemp(prefix='mock_data_')
+        self.product_path = os.path.join(self.directory, 'product.nc')
+        self.__write_product(lat_count, lon_count)
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.http_server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.http_server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.http_server.server_port}'
+        self.api_url = f'{self.url}/api/'
+        self.thread = threading.Thread(target=self.http_server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.http_server.shutdown()
+        self.http_server.server_close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def product_size(self):
+        return os.path.getsize(self.product_path)
+
+    def handle(self, request):
+        time.sleep(self.latency)
+
+        path = request.path.strip('/').split('/')
+        if path[0] == 'data' and len(path) == 2:
+            with open(self.product_path, 'rb') as product:
+                body = product.read()
+            self.__respond(request, body, 'application/x-netcdf')
+            return
+
+        if path[:2] != ['api', 's5p-l3']:
+            request.send_error(404)
+            return
+
+        result = self.__get_catalog(path[2:])
+        if result is None:
+            request.send_error(404)
+            return
+        self.__respond(request, json.dumps(result).encode(), 'application/json')
+
+    def __get_catalog(self, path):
+        api_href = join(self.api_url, 's5p-l3')
+
+        # root catalog, listing the collections
+        if len(path) == 0:
+            return {'links': [
+                {'rel': 'self', 'href': api_href},
+                {'rel': 'child', 'title': 'Mock NO2', 'href': join(api_href, self.COLLECTION)},
+            ]}
+
+        if path[0] != self.COLLECTION:
+            return None
+        collection_href = join(api_href, self.COLLECTION)
+
+        # collection, listing the ranges
+        if len(path) == 1:
+            links = [{'rel': 'self', 'href': collection_href}]
+            for range_name in self.RANGES:
+                links.append({'rel': 'child', 'title': range_name, 'href': join(collection_href, range_name)})
+            return {'links': links}
+
+        # range, listing the specific ranges
+        if len(path) == 2 and path[1] in self.RANGES:
+            links = [{'rel': 'parent', 'href': collection_href}]
+            for i in range(self.SPECIFIC_RANGE_COUNT):
+                title = f'{path[1]}_{i:03d}'
+                links.append({'rel': 'child', 'title': title, 'href': join(collection_href, title)})
+            return {'links': links}
+
+        # specific range, listing the items
+        if len(path) == 2:
+            links = [{'rel': 'parent', 'href': collection_href}]
+            for i in range(self.ITEM_COUNT):
+                title = f'S5P_MOCK_L3__{self.COLLECTION.upper()}_{path[1]}_{i:03d}'
+                links.append({'rel': 'item', 'title': title, 'href': join(collection_href, path[1], f'{title}.json')})
+            return {'links': links}
+
+        # item
+        if len(path) == 3 and path[2].endswith('.json'):
+            name = path[2][:-len('.json')]
+            return {
+                'id': name,
+                'links': [],
+                'assets': {'product': {'href': f'{self.url}/data/{name}.nc'}},
+            }
+
+        return None
+
+    def __respond(self, request, body, content_type):
+        request.send_response(200)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def __write_product(self, lat_count, lon_count):
+        # same layout as the s5p-pal L3 products: one time step on a regular lat/lon grid
+        data_file = netCDF4.Dataset(self.product_path, mode='w')
+        data_file.createDimension('time', 1)
+        data_file.createDimension('latitude', lat_count)
+        data_file.createDimension('longitude', lon_count)
+
+        lat = data_file.createVariable('latitude', 'f4', ('latitude',))
+        lat[:] = np.linspace(-90, 90, lat_count)
+        lon = data_file.createVariable('longitude', 'f4', ('longitude',))
+        lon[:] = np.linspace(-180, 180, lon_count)
+
+        data = data_file.createVariable('tropospheric_NO2_column_number_density', 'f4', ('time', 'latitude', 'longitude'))
+        data.units = 'mol m-2'
+        lat_grid, lon_grid = np.meshgrid(np.radians(lat[:]), np.radians(lon[:]), indexing='ij')
+        data[0] = (1 + np.cos(lat_grid) * np.sin(3 * lon_grid)) * 1e-4
+        data_file.close()
+
+class LatencyHarness:
+    '''The LatencyHarness drives the flow of the application from dropdown
+    selection to recolored data map mesh without opening a window. Every
+    selection goes through the same DataImporter, DataPipeline and TaskScheduler
+    as the GUI, and the results are handed back through a queue that stands in
+    for post_to_main_thread. By default the scheduler coalesces like the GUI
+    does, so every step includes the coalesce delay a user waits for.'''
+
+    TIMEOUT = 60
+
+    def __init__(self, api_url, sample_count, download_directory, coalesce_delay=TaskScheduler.COALESCE_DELAY):
+        super(LatencyHarness, self).__init__()
+        self.download_directory = download_directory
+        self.main_thread_queue = queue.Queue()
+        self.task_scheduler = TaskScheduler(self.main_thread_queue.put, coalesce_delay)
+        self.data_importer = DataImporter(api_url)
+
+        # create the data map mesh the same way as GlobalData
+        mesh_generator = MeshGenerator()
+        points, _, normals, _ = mesh_generator.generate_sphere_points(1, sample_count)
+        pcd = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(points))
+        pcd.normals = o3d.utility.Vector3dVector(normals)
+        self.mesh = geometry.TriangleMesh.create_from_point_cloud_alpha_shape(pcd, 1000)
+
+        mesh_vertices = np.asarray(self.mesh.vertices).copy()
+        lat_index_factors, lon_index_factors = mesh_generator.generate_lat_lon_index_factors(mesh_vertices)
+        self.data_pipeline = DataPipeline(self.data_importer, sample_count, mesh_vertices, lat_index_factors, lon_index_factors, download_directory)
+
+    def clear_downloads(self):
+        shutil.rmtree(self.download_directory, ignore_errors=True)
+
+    def run_selection(self):
+        '''Make the same selections a user would, taking the first option of every
+        dropdown. Returns the latency of every stage and the overall latency in
+        seconds.'''
+        latencies = {}
+        start = time.perf_counter()
+
+        collection = self.data_importer.get_collections()[0]
+        latencies['collections'] = time.perf_counter() - start
+
+        self.__run(self.data_pipeline.links_stages(collection['href']), latencies, 'collection')
+
+        href = self.data_importer.get_range_href(collection['href'], self.data_importer.RANGES[0])
+        links = self.__run(self.data_pipeline.links_stages(href), latencies, 'range')
+        specific_range = [link['title'] for link in links if link['rel'] == 'child'][0]
+
+        href = self.data_importer.get_specific_range_href(collection['href'], specific_range)
+        links = self.__run(self.data_pipeline.links_stages(href), latencies, 'specific range')
+        dataset = [link['title'] for link in links if link['rel'] == 'item'][0]
+
+        href = self.data_importer.get_item_href(collection['href'], specific_range, dataset)
+        self.__run(self.data_pipeline.dataset_stages(href, dataset), latencies, 'dataset', self.__timed_recolor(latencies))
+
+        latencies['overall'] = time.perf_counter() - start
+        return latencies
+
+    def shutdown(self):
+        self.task_scheduler.shutdown()
+        self.data_pipeline.shutdown()
+
+    def __run(self, stages, latencies, name, on_done=None):
+        # the step is timed from submit until the result is applied, the stages of the dataset also separately
+        timed_stages = stages
+        if len(stages) > 1:
+            timed_stages = [(stage, self.__timed(function, latencies, stage)) for stage, function in stages]
+
+        results = []
+        errors = []
+
+        def apply(result):
+            if on_done is not None:
+                on_done(result)
+            results.append(result)
+
+        start = time.perf_counter()
+        self.task_scheduler.submit(timed_stages, apply, errors.append)
+
+        # stand in for the GUI event loop until the result or an error has been posted
+        deadline = start + self.TIMEOUT
+        while len(results) == 0 and len(errors) == 0:
+            try:
+                function = self.main_thread_queue.get(timeout=max(deadline - time.perf_counter(), 0))
+            except queue.Empty:
+                raise TimeoutError(f'{name} did not finish within {self.TIMEOUT} s') from None
+            function()
+
+        if len(errors) > 0:
+            raise RuntimeError(f'{name} failed') from errors[0]
+
+        latencies[name] = time.perf_counter() - start
+        return results[0]
+
+    def __timed_recolor(self, latencies):
+        # same as GlobalData.__create_data_map, without the scene
+        def recolor(result):
+            start = time.perf_counter()
+            _, colors = result
+            self.mesh.vertex_colors = o3d.utility.Vector3dVector(colors)
+            latencies['recolor'] = time.perf_counter() - start
+        return recolor
+
+    def __timed(self, function, latencies, name):
+        def timed_function(task, value):
+            start = time.perf_counter()
+            result = function(task, value)
+            latencies[name] = time.perf_counter() - start
+            return result
+        return timed_function
+
+def print_report(title, runs):
+    print(title)
+    print(f'{"stage":<16}{"n":>6}{"p50 (ms)":>12}{"p95 (ms)":>12}')
+    for name in runs[0]:
+        values = np.array([run[name] for run in runs]) * 1000
+        print(f'{name:<16}{len(values):>6}{np.percentile(values, 50):>12.1f}{np.percentile(values, 95):>12.1f}')
+    print()
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the latency from dropdown selection to recolored data map against a local mock data server.')
+    parser.add_argument('--runs', type=int, default=20, help='number of cold and of warm runs')
+    parser.add_argument('--samples', type=int, default=100000, help='number of points the data map mesh is created from')
+    parser.add_argument('--lat-count', type=int, default=180, help='latitude size of the synthetic product')
+    parser.add_argument('--lon-count', type=int, default=360, help='longitude size of the synthetic product')
+    parser.add_argument('--latency', type=float, default=0.05, help='delay in seconds added to every request')
+    parser.add_argument('--no-coalesce', action='store_true', help='do not wait for the coalesce delay of the GUI, to measure the pipeline only')
+    args = parser.parse_args()
+    if args.runs < 1:
+        parser.error('--runs must be at least 1')
+
+    server = MockDataServer(args.lat_count, args.lon_count, args.latency)
+    server.start()
+    download_directory = tempfile.mkdtemp(prefix='downloaded_data_')
+    coalesce_delay = 0 if args.no_coalesce else TaskScheduler.COALESCE_DELAY
+    harness = LatencyHarness(server.api_url, args.samples, download_directory, coalesce_delay)
+
+    # the decode processes are started with the GUI, before a user can make a selection
+    harness.data_pipeline.wait_until_ready()
+
+    print(f'product size {server.product_size() / 1e6:.1f} MB, request latency {args.latency * 1000:.0f} ms, {args.samples} samples')
+    print(f'coalesce delay {coalesce_delay * 1000:.0f} ms, included in every scheduled step and in overall')
+    print()
+
+    try:
+        # cold runs start without downloaded data, warm runs reuse the download of the previous run
+        cold_runs = []
+        for _ in range(args.runs):
+            harness.clear_downloads()
+            cold_runs.append(harness.run_selection())
+
+        warm_runs = []
+        for _ in range(args.runs):
+            warm_runs.append(harness.run_selection())
+    finally:
+        harness.shutdown()
+        server.stop()
+        shutil.rmtree(download_directory, ignore_errors=True)
+
+    print_report('cold', cold_runs)
+    print_report('warm', warm_runs)
+
+if __name__ == '__main__':
+    main()
@@ -2,12 +2,13 @@ import open3d as o3d
 from open3d import visualization, geometry
 from open3d.visualization import gui
 import numpy as np
-import os
-from posixpath import join
-import urllib.request
+import traceback
+from functools import partial
 from data_loader import DataLoader
 from mesh_generator import MeshGenerator
 from data_importer import DataImporter
+from data_pipeline import DataPipeline
+from task_scheduler import TaskScheduler
 
 class GlobalData:
     SPHERE_SAMPLES = 100000
@@ -16,6 +17,8 @@ class GlobalData:
     STAR_RADIUS = 10
     SUN_DISTANCE = 11
 
+    LOADING_FAILED_TEXT = 'Laden mislukt, kies opnieuw'
+
     DEFAULT_DATA_MAP_OPACITY = 0.4
     DEFAULT_SUN_ROTATION = 180
 
@@ -31,6 +34,7 @@ class GlobalData:
         self.data_loader = DataLoader(self.SPHERE_SAMPLES)
         self.mesh_generator = MeshGenerator()
         self.data_importer = DataImporter()
+        self.task_scheduler = TaskScheduler(self.__post_to_main_thread)
 
         # set margins for easy access
         em = self.window.theme.font_size
@@ -52,6 +56,8 @@ class GlobalData:
         self.__plot_stars()
         self.__create_data_points()
 
+        self.data_pipeline = DataPipeline(self.data_importer, self.SPHERE_SAMPLES, self.mesh_vertices, self.lat_index_factors, self.lon_index_factors)
+
     def __create_simulation_window(self):
         # Set up globe and camera location
         globeLocation = [0, 0, 0]
@@ -159,7 +165,7 @@ class GlobalData:
 
         sun_slider = gui.Slider(gui.Slider.INT)
         sun_slider.set_limits(0, 360)
-        sun_slider.set_on_value_changed(self.__on_sun_slider)
+        sun_slider.set_on_value_changed(lambda rotation: self.task_scheduler.coalesce('sun', self.__on_sun_slider, rotation))
         sun_slider.int_value = self.DEFAULT_SUN_ROTATION
 
         sun_slider_layout.add_child(gui.Label('Zon locatie'))
@@ -172,7 +178,7 @@ class GlobalData:
 
         opacity_slider = gui.Slider(gui.Slider.DOUBLE)
         opacity_slider.set_limits(0, 1)
-        opacity_slider.set_on_value_changed(self.__on_opacity_slider)
+        opacity_slider.set_on_value_changed(lambda opacity: self.task_scheduler.coalesce('opacity', self.__on_opacity_slider, opacity))
         opacity_slider.double_value = self.DEFAULT_DATA_MAP_OPACITY
 
         opacity_slider_layout.add_child(gui.Label('Doorzichtigheid'))
@@ -213,6 +219,7 @@ class GlobalData:
         self.dataset_dropdown.clear_items()
 
         if index == 0:
+            self.task_scheduler.cancel()
             return
         
         for collection in self.collections:
@@ -220,8 +227,9 @@ class GlobalData:
                 self.selected_collection = collection
                 break
         
-        self.data_importer.get_links(self.selected_collection['href'])
+        self.task_scheduler.submit(self.data_pipeline.links_stages(self.selected_collection['href']), self.__on_collection_loaded, partial(self.__on_links_error, self.range_dropdown))
 
+    def __on_collection_loaded(self, links):
         ranges = ['Kies een range', 'dag', '3 dagen', 'maand', 'seizoen', 'jaar']
         for range in ranges:
             self.range_dropdown.add_item(range)
@@ -233,14 +241,15 @@ class GlobalData:
         self.dataset_dropdown.clear_items()
 
         if index == 0:
+            self.task_scheduler.cancel()
             return
         
-        ranges = ['', 'day', '3day', 'month', 'season', 'year']
-        self.selected_range = ranges[index]
+        self.selected_range = self.data_importer.RANGES[index - 1]
 
-        href = join(self.selected_collection['href'], ranges[index])
-        links = self.data_importer.get_links(href)
+        href = self.data_importer.get_range_href(self.selected_collection['href'], self.selected_range)
+        self.task_scheduler.submit(self.data_pipeline.links_stages(href), self.__on_range_loaded, partial(self.__on_links_error, self.specific_range_dropdown))
 
+    def __on_range_loaded(self, links):
         self.specific_range_dropdown.add_item('Kies specifieke range')
 
         for link in links:
@@ -253,11 +262,13 @@ class GlobalData:
         self.dataset_dropdown.clear_items()
 
         if index == 0:
+            self.task_scheduler.cancel()
             return
         
-        href = join(self.selected_collection['href'], specific_range)
-        links = self.data_importer.get_links(href)
+        href = self.data_importer.get_specific_range_href(self.selected_collection['href'], specific_range)
+        self.task_scheduler.submit(self.data_pipeline.links_stages(href), self.__on_specific_range_loaded, partial(self.__on_links_error, self.dataset_dropdown))
 
+    def __on_specific_range_loaded(self, links):
         self.dataset_dropdown.add_item('Kies item')
 
         for link in links:
@@ -269,16 +280,24 @@ class GlobalData:
         self.__delete_data_map()
 
         if index == 0:
+            self.task_scheduler.cancel()
             return
         
-        href = join(self.selected_collection['href'], self.specific_range_dropdown.selected_text, f'{dataset}.json')
-        json = self.data_importer.get_json(href)
-
-        download_link = json['assets']['product']['href']
-
-        if not os.path.isfile(f'./downloaded_data/{dataset}.nc'):
-            urllib.request.urlretrieve(download_link, f'./downloaded_data/{dataset}.nc')
-        self.__create_data_map(f'./downloaded_data/{dataset}.nc')
+        href = self.data_importer.get_item_href(self.selected_collection['href'], self.specific_range_dropdown.selected_text, dataset)
+        self.task_scheduler.submit(self.data_pipeline.dataset_stages(href, dataset), self.__create_data_map, self.__on_dataset_error)
+
+    def __on_links_error(self, dropdown, exception):
+        # show that the next dropdown could not be filled, so the user can select again
+        traceback.print_exception(exception)
+        dropdown.clear_items()
+        dropdown.add_item(self.LOADING_FAILED_TEXT)
+
+    def __on_dataset_error(self, exception):
+        traceback.print_exception(exception)
+        self.dataset_dropdown.selected_text = 'Kies item'
+        self._scale_param_label.text = self.LOADING_FAILED_TEXT
+        self._scale_lower_label.text = ''
+        self._scale_upper_label.text = ''
 
     def __on_layout(self, layout_context):
         r = self.window.content_rect
@@ -321,8 +340,11 @@ class GlobalData:
         self.data_points = pcd
 
         self._mesh = geometry.TriangleMesh.create_from_point_cloud_alpha_shape(self.data_points, 1000)
+
+        # copy the vertices, so the worker threads never read the mesh while it is being recolored
+        self.mesh_vertices = np.asarray(self._mesh.vertices).copy()
         
-        lat_index_factors, lon_index_factors = self.mesh_generator.generate_lat_lon_index_factors(np.asarray(self._mesh.vertices))
+        lat_index_factors, lon_index_factors = self.mesh_generator.generate_lat_lon_index_factors(self.mesh_vertices)
 
         self.lat_index_factors = lat_index_factors
         self.lon_index_factors = lon_index_factors
@@ -331,17 +353,17 @@ class GlobalData:
         self._scene.scene.remove_geometry('data_map')
         pass
 
-    def __create_data_map(self, file_path):
-        # load new file and convert to colors
-        self.data_loader.load_file(file_path)
-        colors = self.data_loader.convert_data_to_colors_one_point(np.asarray(self._mesh.vertices), self.lat_index_factors, self.lon_index_factors)
+    def __create_data_map(self, result):
+        # file is loaded and converted to colors by the data pipeline
+        self.data_loader, colors = result
 
-        # set label text
+        # set label text. str() shows min and max with the precision of the data
         self._scale_param_label.text = self.data_loader.name
-        self._scale_lower_label.text = f'{self.data_loader.min_value} {self.data_loader.unit}'
-        self._scale_upper_label.text = f'{self.data_loader.max_value} {self.data_loader.unit}'
+        self._scale_lower_label.text = f'{self.data_loader.min_value!s} {self.data_loader.unit}'
+        self._scale_upper_label.text = f'{self.data_loader.max_value!s} {self.data_loader.unit}'
     
         # remove mesh, update colors and add mesh
+        # colors is a contiguous (N, 3) float64 array, so it is copied into the mesh without a per-point conversion
         self._scene.scene.remove_geometry('data_map')
         self._mesh.vertex_colors = o3d.utility.Vector3dVector(colors)
         self._scene.scene.add_geometry('data_map', self._mesh, self.data_map_mat)
@@ -356,8 +378,13 @@ class GlobalData:
         pcd.point.colors = colors
         self._scene.scene.add_geometry('stars', pcd, mat)
 
+    def __post_to_main_thread(self, function):
+        gui.Application.instance.post_to_main_thread(self.window, function)
+
     def run(self):
         gui.Application.instance.run()
+        self.task_scheduler.shutdown()
+        self.data_pipeline.shutdown()
 
 if __name__ == '__main__':
     globalData = GlobalData()
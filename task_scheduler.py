@@ -0,0 +1,177 @@
+import queue
+import threading
+import time
+import traceback
+
+class TaskCancelled(Exception):
+    '''Raised by a stage function when it notices its task has been superseded.'''
+    pass
+
+class Task:
+    '''A single run through the pipeline. The task belongs to the generation that
+    was current when it was submitted, and is cancelled as soon as a newer
+    generation is started.'''
+
+    def __init__(self, scheduler, generation, stages, on_done, on_error=None):
+        super(Task, self).__init__()
+        self.scheduler = scheduler
+        self.generation = generation
+        self.stages = stages
+        self.on_done = on_done
+        self.on_error = on_error
+
+    def is_cancelled(self):
+        return self.generation != self.scheduler.generation
+
+    def check_cancelled(self):
+        if self.is_cancelled():
+            raise TaskCancelled()
+
+class TaskScheduler:
+    '''The TaskScheduler runs the work behind the dropdowns off the GUI thread.
+    Every stage has its own queue and workers, so work in one stage does not wait
+    for another stage. Submitting new work starts a new generation, which makes
+    all older tasks stale: they are dropped when they reach the next stage, and
+    their results are never handed to the GUI.
+
+    A stage function that is already running cannot be interrupted. The fetch and
+    decode stages have more than one worker, so a stale request or file that is
+    still running only takes up one of them and newer work starts right away.
+    The download, sample and color stages have a single worker, and their stage
+    functions check for cancellation regularly instead.
+
+    Results are only passed back through the given post function, which should
+    be post_to_main_thread for the open3d GUI.'''
+
+    STAGES = ['fetch', 'download', 'decode', 'sample', 'color']
+    WORKER_COUNTS = {'fetch': 4, 'download': 1, 'decode': 2, 'sample': 1, 'color': 1}
+
+    # time to wait for further events before a submitted task is started
+    COALESCE_DELAY = 0.05
+
+    # time to wait for the workers on shutdown. Workers are daemon threads, so a
+    # stalled fetch or download does not keep the process alive after this
+    SHUTDOWN_TIMEOUT = 1
+
+    def __init__(self, post_to_main_thread, coalesce_delay=COALESCE_DELAY):
+        super(TaskScheduler, self).__init__()
+        self.post_to_main_thread = post_to_main_thread
+        self.coalesce_delay = coalesce_delay
+        self.generation = 0
+
+        self._lock = threading.Lock()
+        self._pending_timer = None
+        self._pending_values = {}
+
+        self.queues = {}
+        self.workers = []
+        for stage in self.STAGES:
+            self.queues[stage] = queue.Queue()
+            for i in range(self.WORKER_COUNTS[stage]):
+                worker = threading.Thread(target=self.__run_worker, args=(stage,), name=f'{stage}-worker-{i}', daemon=True)
+                worker.start()
+                self.workers.append(worker)
+
+    def cancel(self):
+        '''Start a new generation, which cancels all work that is in progress.'''
+        with self._lock:
+            self.generation += 1
+            if self._pending_timer is not None:
+                self._pending_timer.cancel()
+                self._pending_timer = None
+            return self.generation
+
+    def submit(self, stages, on_done, on_error=None):
+        '''Submit a task consisting of a list of (stage, function) pairs. Each
+        function is called with the task and the result of the previous stage, and
+        on_done is called on the main thread with the result of the last stage.
+        If a stage raises, on_error is called on the main thread with the
+        exception, or the traceback is printed when there is no on_error.
+        Tasks submitted in quick succession are coalesced, so only the last one
+        is run.'''
+        generation = self.cancel()
+        task = Task(self, generation, stages, on_done, on_error)
+
+        if self.coalesce_delay <= 0:
+            self.__start(task)
+            return task
+
+        with self._lock:
+            self._pending_timer = threading.Timer(self.coalesce_delay, self.__start, args=(task,))
+            self._pending_timer.daemon = True
+            self._pending_timer.start()
+        return task
+
+    def coalesce(self, key, function, value):
+        '''Call function with the latest value for key on the main thread. Values
+        that arrive before the previous one has been applied replace it, so a
+        slider that fires many events per frame is only applied once.'''
+        with self._lock:
+            already_posted = key in self._pending_values
+            self._pending_values[key] = value
+
+        if already_posted:
+            return
+
+        def apply():
+            with self._lock:
+                latest_value = self._pending_values.pop(key)
+            function(latest_value)
+
+        self.post_to_main_thread(apply)
+
+    def shutdown(self):
+        self.cancel()
+        for stage in self.STAGES:
+            for _ in range(self.WORKER_COUNTS[stage]):
+                self.queues[stage].put(None)
+        deadline = time.monotonic() + self.SHUTDOWN_TIMEOUT
+        for worker in self.workers:
+            worker.join(max(deadline - time.monotonic(), 0))
+
+    def __start(self, task):
+        if task.is_cancelled() or len(task.stages) == 0:
+            return
+        stage, _ = task.stages[0]
+        self.queues[stage].put((task, 0, None))
+
+    def __run_worker(self, stage):
+        stage_queue = self.queues[stage]
+        while True:
+            item = stage_queue.get()
+            if item is None:
+                return
+
+            task, index, value = item
+            if task.is_cancelled():
+                continue
+
+            _, function = task.stages[index]
+            try:
+                value = function(task, value)
+            except TaskCancelled:
+                continue
+            except Exception as exception:
+                if task.on_error is None:
+                    traceback.print_exc()
+                else:
+                    self.__post(task, task.on_error, exception)
+                continue
+
+            if task.is_cancelled():
+                continue
+
+            index += 1
+            if index < len(task.stages):
+                next_stage, _ = task.stages[index]
+                self.queues[next_stage].put((task, index, value))
+            else:
+                self.__post(task, task.on_done, value)
+
+    def __post(self, task, function, value):
+        def apply():
+            # a newer selection may have been made while this was waiting
+            if not task.is_cancelled():
+                function(value)
+
+        self.post_to_main_thread(apply)